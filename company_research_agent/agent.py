@@ -1,137 +1,294 @@
+import asyncio
 import re
-import requests
-from typing import Dict, Any, List
+import threading
+import weakref
+from typing import Awaitable, Callable, Dict, Any, List, Optional
+from urllib.parse import quote
 
+import httpx
+import orjson
+from cachetools import TTLCache, cached
+
+from google.adk.agents.callback_context import CallbackContext
+from google.adk.agents.context_cache_config import ContextCacheConfig
 from google.adk.agents.llm_agent import Agent
+from google.adk.apps.app import App
+from google.adk.models import LlmRequest, LlmResponse
+from google.adk.plugins.base_plugin import BasePlugin
+from google.genai import types
+
+from .text_utils import extract_years, update_markdown_section
 
 # Helper functions: HTTP calls + parsing
 
-def fetch_wikipedia_summary(company_name: str) -> str:
+_WIKIPEDIA_SUMMARY_URL = "https://en.wikipedia.org/api/rest_v1/page/summary/"
+_DUCKDUCKGO_URL = "https://api.duckduckgo.com/"
+_HTTP_TIMEOUT_SECONDS = 10
+# Summaries are a few KB; DuckDuckGo's RelatedTopics can run to tens of KB.
+# Anything past this cap is truncated and rejected rather than parsed.
+_MAX_RESPONSE_BYTES = 256 * 1024
+_CACHE_TTL_SECONDS = 3600
+# Rate limits and transient server errors are retried with exponential
+# backoff instead of surfacing as "no external data".
+_RETRY_STATUSES = (429, 500, 502, 503, 504)
+_RETRY_ATTEMPTS = 3
+_RETRY_BACKOFF_SECONDS = 0.2
+_HTTP_HEADERS = {
+    "User-Agent": "research_assistant/1.0",
+    "Accept-Encoding": "gzip",
+}
+
+# One pooled httpx client per event loop: keep-alive connections survive
+# across tool calls on the same loop, negotiating HTTP/2 where the server
+# offers it. Connections belong to the loop that opened them, and ADK's sync
+# Runner.run starts a fresh loop per call, so a single module-level client
+# would reuse sockets from a closed loop. Entries go away with their loop.
+_ASYNC_CLIENTS: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def _async_client() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_CLIENTS.get(loop)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            http2=True,
+            # Wikipedia answers redirect and non-canonical titles with a 302,
+            # so follow redirects before raise_for_status() sees the response.
+            follow_redirects=True,
+            headers=_HTTP_HEADERS,
+            timeout=_HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(max_keepalive_connections=8, max_connections=16),
+        )
+        _ASYNC_CLIENTS[loop] = client
+    return client
+
+
+async def _close_async_client() -> None:
     """
-    Fetch a short summary for the company from Wikipedia REST API.
-    If the HTTP call fails, return an empty string so the agent can
-    still use its own knowledge.
+    Close the running loop's client, on the loop that owns its connections.
     """
-    url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{company_name}"
-    try:
-        resp = requests.get(url, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            return data.get("extract", "") or ""
-        return ""
-    except Exception:
-        return ""
+    client = _ASYNC_CLIENTS.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.aclose()
 
 
-def fetch_duckduckgo_summary(company_name: str) -> str:
+class HttpClientPlugin(BasePlugin):
     """
-    Fetch a short abstract for the company from DuckDuckGo Instant Answer API.
-    If the HTTP call fails, return an empty string so the agent can
-    still use its own knowledge.
+    Closes the pooled HTTP client when the ADK runner shuts down.
     """
-    url = "https://api.duckduckgo.com/"
-    params = {
+
+    def __init__(self) -> None:
+        super().__init__(name="http_client")
+
+    async def close(self) -> None:
+        await _close_async_client()
+
+
+def _wikipedia_url(company_name: str) -> str:
+    # Wikipedia titles use underscores; quote everything else (including "/")
+    # so multi-word names hit the page instead of a 404.
+    title = quote(company_name.strip().replace(" ", "_"), safe="")
+    return f"{_WIKIPEDIA_SUMMARY_URL}{title}"
+
+
+def _duckduckgo_params(company_name: str) -> Dict[str, Any]:
+    return {
         "q": company_name,
         "format": "json",
         "no_html": 1,
         "skip_disambig": 1,
     }
-    try:
-        resp = requests.get(url, params=params, timeout=10)
-        if resp.status_code == 200:
-            data = resp.json()
-            abstract = data.get("Abstract", "")
-            if abstract:
-                return abstract
-            related = data.get("RelatedTopics", [])
-            if related and isinstance(related, list):
-                first = related[0]
-                if isinstance(first, dict):
-                    return first.get("Text", "") or ""
-            return ""
-        return ""
-    except Exception:
+
+
+def _parse_wikipedia(data: Dict[str, Any]) -> str:
+    return data.get("extract", "") or ""
+
+
+def _parse_duckduckgo(data: Dict[str, Any]) -> str:
+    abstract = data.get("Abstract", "")
+    if abstract:
+        return abstract
+    related = data.get("RelatedTopics", [])
+    if related and isinstance(related, list):
+        first = related[0]
+        if isinstance(first, dict):
+            return first.get("Text", "") or ""
+    return ""
+
+
+def _retry_delay(retry_after: Optional[str], attempt: int) -> float:
+    # Honour a numeric Retry-After, but never wait longer than one request
+    # timeout; otherwise back off exponentially.
+    if retry_after and retry_after.isdigit():
+        return min(float(retry_after), _HTTP_TIMEOUT_SECONDS)
+    return _RETRY_BACKOFF_SECONDS * (2**attempt)
+
+
+async def _get_json(
+    url: str, params: Optional[Dict[str, Any]] = None
+) -> Dict[str, Any]:
+    """
+    GET a JSON document through the shared async client, retrying
+    _RETRY_STATUSES with backoff; any remaining error status raises.
+    The body is capped at _MAX_RESPONSE_BYTES; a truncated document fails
+    to parse and raises.
+    """
+    attempt = 0
+    while True:
+        async with _async_client().stream("GET", url, params=params) as resp:
+            if resp.status_code in _RETRY_STATUSES and attempt < _RETRY_ATTEMPTS:
+                delay = _retry_delay(resp.headers.get("Retry-After"), attempt)
+            else:
+                resp.raise_for_status()
+                body = bytearray()
+                async for chunk in resp.aiter_bytes():
+                    body += chunk
+                    if len(body) >= _MAX_RESPONSE_BYTES:
+                        break
+                break
+        await asyncio.sleep(delay)
+        attempt += 1
+    # Parse the raw bytes ourselves: DuckDuckGo labels its JSON as
+    # application/x-javascript, and orjson is much faster than json.
+    return orjson.loads(body[:_MAX_RESPONSE_BYTES])
+
+
+async def _fetch_wikipedia(company_name: str) -> str:
+    """
+    Fetch a short summary for the company from Wikipedia REST API.
+    """
+    if not company_name.strip():
         return ""
+    data = await _get_json(_wikipedia_url(company_name))
+    return _parse_wikipedia(data) if data else ""
 
 
-def extract_years(text: str) -> List[int]:
+async def _fetch_duckduckgo(company_name: str) -> str:
     """
-    Extract plausible years (1900-2099) from a text.
-    Used to detect conflicting founding years, etc.
+    Fetch a short abstract for the company from DuckDuckGo Instant Answer API.
     """
-    pattern = r"\b(19\d{2}|20\d{2})\b"
-    years = re.findall(pattern, text or "")
-    return sorted({int(y) for y in years})
+    if not company_name.strip():
+        return ""
+    data = await _get_json(_DUCKDUCKGO_URL, _duckduckgo_params(company_name))
+    return _parse_duckduckgo(data) if data else ""
 
 
-def update_markdown_section(
-    existing_plan: str, section_name: str, new_section_body: str
-) -> str:
+async def _fetch_summaries(company_name: str) -> List[str]:
+    """
+    Fetch the Wikipedia and DuckDuckGo summaries concurrently.
+    If a call fails, that source yields an empty string so the agent can
+    still use its own knowledge.
     """
-    Update or insert a specific '## section_name' in a markdown document.
-    Returns updated markdown.
+    results = await asyncio.gather(
+        _fetch_wikipedia(company_name),
+        _fetch_duckduckgo(company_name),
+        return_exceptions=True,
+    )
+    return ["" if isinstance(r, BaseException) else r for r in results]
+
 
-    - If section exists, its body is replaced.
-    - If it does not exist, it is appended at the end.
+def _run_fetch(fetch: Callable[[str], Awaitable[str]], company_name: str) -> str:
+    """
+    Run one async fetcher to completion from sync code, closing the loop's
+    HTTP client before the loop goes away.
     """
-    if not existing_plan:
-        return f"## {section_name}\n{new_section_body.strip()}\n"
 
-    pattern = rf"(##\s+{re.escape(section_name)}\s*\n)(.*?)(?=\n##\s+|\Z)"
-    match = re.search(pattern, existing_plan, flags=re.DOTALL)
+    async def run() -> str:
+        try:
+            return await fetch(company_name)
+        finally:
+            await _close_async_client()
 
-    if match:
-        start, end = match.span(2)
-        updated = (
-            existing_plan[:start]
-            + "\n"
-            + new_section_body.strip()
-            + "\n"
-            + existing_plan[end:]
-        )
-        return updated
-    else:
-        # Append new section at the end
-        if not existing_plan.endswith("\n"):
-            existing_plan += "\n"
-        return existing_plan + f"\n## {section_name}\n{new_section_body.strip()}\n"
+    return asyncio.run(run())
 
 
-# ADK TOOLS
+# Successful lookups are cached for an hour. Exceptions propagate out of the
+# cached functions, so network failures are never cached.
+@cached(TTLCache(maxsize=256, ttl=_CACHE_TTL_SECONDS), lock=threading.Lock())
+def _wikipedia_summary_cached(company_name: str) -> str:
+    return _run_fetch(_fetch_wikipedia, company_name)
 
 
-def research_company(company_name: str) -> Dict[str, Any]:
+@cached(TTLCache(maxsize=256, ttl=_CACHE_TTL_SECONDS), lock=threading.Lock())
+def _duckduckgo_summary_cached(company_name: str) -> str:
+    return _run_fetch(_fetch_duckduckgo, company_name)
+
+
+def fetch_wikipedia_summary(company_name: str) -> str:
     """
-    Tool: research_company
+    Fetch a short summary for the company from Wikipedia REST API.
+    If the HTTP call fails, return an empty string so the agent can
+    still use its own knowledge.
 
+    Blocking helper for callers outside an event loop; the agent itself
+    uses the async fetchers.
+    """
+    if not company_name.strip():
+        return ""
+    try:
+        return _wikipedia_summary_cached(company_name)
+    except Exception:
+        return ""
+
+
+def fetch_duckduckgo_summary(company_name: str) -> str:
+    """
+    Fetch a short abstract for the company from DuckDuckGo Instant Answer API.
+    If the HTTP call fails, return an empty string so the agent can
+    still use its own knowledge.
+
+    Blocking helper for callers outside an event loop; the agent itself
+    uses the async fetchers.
+    """
+    if not company_name.strip():
+        return ""
+    try:
+        return _duckduckgo_summary_cached(company_name)
+    except Exception:
+        return ""
+
+
+# ADK TOOLS
+
+# research_company results keyed by normalized company name, so repeated
+# questions about the same company skip the network entirely.
+_RESEARCH_CACHE: TTLCache = TTLCache(maxsize=512, ttl=_CACHE_TTL_SECONDS)
+
+# Lookups currently running, keyed like _RESEARCH_CACHE. Concurrent requests
+# for the same company await the first one instead of refetching.
+_INFLIGHT: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+
+# Conflicting years reported when neither source answers, keyed by
+# lowercased company name.
+_SYNTHETIC_CONFLICTS: Dict[str, List[int]] = {
+    "ibm": [1896, 1911, 1924],
+    "sony": [1945, 1946, 1958],
+    "nokia": [1865, 1871, 1876],
+    "panasonic": [1918, 1927, 1935],
+    "accenture": [1950, 1989, 2001],
+}
+
+async def _research_async(company_name: str) -> Dict[str, Any]:
+    """
     Gathers information about a company from multiple public sources
     and detects conflicting founding years.
     """
-    wiki = fetch_wikipedia_summary(company_name)
-    ddg = fetch_duckduckgo_summary(company_name)
+    wiki, ddg = await _fetch_summaries(company_name)
 
-    years = set(extract_years(wiki)) | set(extract_years(ddg))
-    years_list = sorted(years)
+    # One regex sweep over both summaries; the newline keeps a year at the
+    # end of one from running into the start of the other.
+    years_list = extract_years(f"{wiki}\n{ddg}")
     has_conflict = len(years_list) > 1
 
-    no_external = (wiki.strip() == "") and (ddg.strip() == "")
-
-    synthetic_conflicts = {
-        "IBM": [1896, 1911, 1924],
-        "Sony": [1945, 1946, 1958],
-        "Nokia": [1865, 1871, 1876],
-        "Panasonic": [1918, 1927, 1935],
-        "Accenture": [1950, 1989, 2001],
-    }
+    no_external = not wiki.strip() and not ddg.strip()
 
     normalized = company_name.strip().lower()
 
     if no_external:
-        for key, years in synthetic_conflicts.items():
-            if key.lower() == normalized:
-                years_list = years
-                has_conflict = True
-                break
+        preset = _SYNTHETIC_CONFLICTS.get(normalized)
+        if preset:
+            years_list = preset
+            has_conflict = True
 
     return {
         "company": company_name,
@@ -142,6 +299,83 @@ def research_company(company_name: str) -> Dict[str, Any]:
         "no_external_data": no_external,
     }
 
+
+async def research_company(company_name: str) -> Dict[str, Any]:
+    """
+    Tool: research_company
+
+    Gathers information about a company from multiple public sources
+    and detects conflicting founding years.
+    """
+    # ADK awaits coroutine tools, so the event loop keeps streaming while the
+    # requests are in flight. The cache and in-flight map are only touched
+    # from that loop, with no await between a lookup and its store, so they
+    # need no lock.
+    key = company_name.strip().lower()
+    if not key:
+        # Nothing to look up; don't send an empty query to either source.
+        return {
+            "company": company_name,
+            "wikipedia_summary": "",
+            "duckduckgo_summary": "",
+            "extracted_years": [],
+            "has_conflict": False,
+            "no_external_data": True,
+        }
+    if key in _RESEARCH_CACHE:
+        return {**_RESEARCH_CACHE[key], "company": company_name}
+
+    while (pending := _INFLIGHT.get(key)) is not None:
+        # Shield so a cancelled waiter doesn't cancel the shared lookup.
+        try:
+            result = await asyncio.shield(pending)
+        except asyncio.CancelledError:
+            # Only retry when the leading call was cancelled and this one
+            # wasn't. Task.cancelling() needs 3.11+; without it we can't tell
+            # the two apart, so the cancellation propagates.
+            cancelling = getattr(asyncio.current_task(), "cancelling", None)
+            if not pending.cancelled() or cancelling is None or cancelling():
+                raise
+            # The leader's entry is gone, so loop round and look the company
+            # up ourselves.
+            continue
+        return {**result, "company": company_name}
+
+    pending = asyncio.get_running_loop().create_future()
+    _INFLIGHT[key] = pending
+    try:
+        result = await _research_async(company_name)
+    except Exception as exc:
+        pending.set_exception(exc)
+        # Mark it retrieved so a lookup nobody else waited on doesn't log
+        # "exception was never retrieved"; waiters still get it raised.
+        pending.exception()
+        raise
+    except BaseException:
+        pending.cancel()
+        raise
+    else:
+        pending.set_result(result)
+    finally:
+        _INFLIGHT.pop(key, None)
+
+    # Don't pin an outage for an hour; retry the sources next time.
+    if not result["no_external_data"]:
+        _RESEARCH_CACHE[key] = result
+    return result
+
+
+async def research_companies(company_names: List[str]) -> List[Dict[str, Any]]:
+    """
+    Tool: research_companies
+
+    Researches several companies at once (for example a parent company and
+    its subsidiaries). Returns one research_company result per name, in the
+    same order.
+    """
+    return list(await asyncio.gather(*(research_company(n) for n in company_names)))
+
+
 def update_account_plan(
     existing_plan_markdown: str, section_name: str, new_section_body: str
 ) -> str:
@@ -153,6 +387,132 @@ def update_account_plan(
     return update_markdown_section(existing_plan_markdown, section_name, new_section_body)
 
 
+# MODEL CALLBACKS
+
+# Only a whole, single-line request whose new content is quoted verbatim
+# (e.g. Update the Opportunities section to "Cloud migration and AI.") is
+# applied without the model. Anything looser, such as an instruction to
+# "focus on" something, a negation or a compound request, needs the model
+# to write or decide on the content.
+_UPDATE_INTENT = re.compile(
+    r"(?:please\s+)?update\s+the\s+(?P<section>[^\"\u201c\u201d\n]+?)\s+section"
+    r"\s+to(?:\s+(?:say|read))?:?\s*"
+    r"[\"\u201c](?P<body>[^\"\u201c\u201d\n]+)[\"\u201d]\s*[.!]?",
+    re.IGNORECASE,
+)
+# Every generated plan starts with this heading (see the instruction below).
+_PLAN_MARKER = "## Company Overview"
+_PLAN_STATE_KEY = "account_plan"
+# Closing remarks the model tends to add after the plan. Only a trailing
+# single-line, unformatted paragraph that is a question or opens like one of
+# these is trimmed; lists, tables, sub-headings and notes are always kept.
+_CHATTER = re.compile(
+    r"(?:let me know|feel free|would you like|do you want|shall i|"
+    r"if you(?:'d| would) like|i hope|hope this|happy to)\b",
+    re.IGNORECASE,
+)
+_STRUCTURED = re.compile(r"\s*(?:[-*+>|#_]|\d+[.)]|\*\*)")
+_RULES = ("---", "***", "___")
+
+
+def _latest_user_text(llm_request: LlmRequest) -> str:
+    """
+    Text of the newest user message, or "" if the newest content is anything
+    else (e.g. a function response mid tool-call loop).
+    """
+    if not llm_request.contents:
+        return ""
+    content = llm_request.contents[-1]
+    if content.role != "user" or not content.parts:
+        return ""
+    if any(part.function_response for part in content.parts):
+        return ""
+    return "".join(part.text or "" for part in content.parts)
+
+
+def _resolve_section_heading(plan: str, section_name: str) -> Optional[str]:
+    """
+    Map a user's section reference onto one heading of the plan: an exact
+    (case-insensitive) match, else the single heading it is a prefix of.
+    """
+    wanted = section_name.strip().lower()
+    headings = [
+        line[3:].strip() for line in plan.splitlines() if line.startswith("## ")
+    ]
+    for heading in headings:
+        if heading.lower() == wanted:
+            return heading
+    candidates = [h for h in headings if h.lower().startswith(wanted)]
+    return candidates[0] if len(candidates) == 1 else None
+
+
+def _is_chatter(paragraph: str) -> bool:
+    if paragraph in _RULES:
+        return True
+    if "\n" in paragraph or _STRUCTURED.match(paragraph):
+        return False
+    return paragraph.endswith("?") or bool(_CHATTER.match(paragraph))
+
+
+def _extract_plan(text: str, start: int) -> str:
+    """
+    The account plan inside a model reply: everything from the first heading
+    to the end, minus trailing closing remarks after the last section.
+    """
+    plan = text[start:].rstrip()
+    body_start = plan.find("\n", plan.rfind("\n## ") + 1)
+    while body_start != -1:
+        cut = plan.rfind("\n\n")
+        if cut < body_start or not _is_chatter(plan[cut:].strip()):
+            break
+        plan = plan[:cut].rstrip()
+    return plan + "\n"
+
+
+def remember_account_plan(
+    callback_context: CallbackContext, llm_response: LlmResponse
+) -> Optional[LlmResponse]:
+    """
+    After-model callback: keep the latest account plan the model produced in
+    session state so section updates can be applied without the model.
+    """
+    if llm_response.partial or not llm_response.content:
+        return None
+    text = "".join(part.text or "" for part in llm_response.content.parts or [])
+    start = text.find(_PLAN_MARKER)
+    if start != -1:
+        callback_context.state[_PLAN_STATE_KEY] = _extract_plan(text, start)
+    return None
+
+
+def apply_section_update(
+    callback_context: CallbackContext, llm_request: LlmRequest
+) -> Optional[LlmResponse]:
+    """
+    Before-model callback: answer 'Update the X section to "Y"' directly with
+    update_markdown_section when the current plan is known and X names one
+    of its sections. Anything else falls through to the model.
+    """
+    text = _latest_user_text(llm_request).strip()
+    match = _UPDATE_INTENT.fullmatch(text) if "\n" not in text else None
+    plan = callback_context.state.get(_PLAN_STATE_KEY)
+    if not match or not plan:
+        return None
+    heading = _resolve_section_heading(plan, match.group("section"))
+    if heading is None:
+        return None
+
+    updated = update_markdown_section(plan, heading, match.group("body"))
+    callback_context.state[_PLAN_STATE_KEY] = updated
+    reply = (
+        f"I've updated the **{heading}** section. "
+        f"Here is the revised account plan:\n\n{updated}"
+    )
+    return LlmResponse(
+        content=types.Content(role="model", parts=[types.Part(text=reply)])
+    )
+
+
 # ROOT AGENT DEFINITION
 
 
@@ -164,7 +524,11 @@ root_agent = Agent(
         "information, and generates structured account plans. It can also update "
         "individual sections of an existing account plan when the user requests it."
     ),
-    instruction="""
+    # The prompt never changes and has no {state} placeholders, so send it as
+    # static_instruction: ADK passes it through verbatim at the very start of
+    # every request, which keeps it a stable, cacheable prefix. Tool results
+    # only ever appear after it in the conversation contents.
+    static_instruction="""
 You are a Company Research Assistant and Account Plan Generator.
 
 YOUR GOALS:
@@ -194,6 +558,11 @@ TOOL USAGE GUIDELINES:
   "I need an account plan for TCS"),
   ALWAYS call the `research_company` tool first with the company name.
 
+- When the user lists multiple companies (for example a parent company and its
+  subsidiaries, or several competitors), call `research_companies` ONCE with all
+  of the names instead of calling `research_company` for each one. It returns
+  one result per company, in the same order, with the same fields.
+
 - After calling `research_company`, pay attention to these fields:
     - company
     - wikipedia_summary
@@ -256,5 +625,20 @@ STYLE:
 - Be concise but insightful.
 - Do not refuse to answer just because external tools failed; always try to help.
 """,
-    tools=[research_company, update_account_plan],
+    tools=[research_company, research_companies, update_account_plan],
+    before_model_callback=apply_section_update,
+    after_model_callback=remember_account_plan,
+)
+
+
+# Wrapping the agent in an App turns on Gemini context caching: the static
+# prompt and tool declarations are uploaded once as cached content and
+# reused across turns instead of being re-sent and re-processed each time.
+# Gemini only caches prefixes above its model minimum (2048 tokens for 2.5),
+# so this pays off on longer conversations.
+app = App(
+    name="company_research_agent",
+    root_agent=root_agent,
+    plugins=[HttpClientPlugin()],
+    context_cache_config=ContextCacheConfig(ttl_seconds=3600),
 )
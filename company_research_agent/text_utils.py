@@ -0,0 +1,60 @@
+"""
+Pure text helpers used by the agent: year extraction and markdown section
+updates.
+
+This module deliberately has no third-party imports and is fully annotated
+so it can be compiled ahead of time for the plan-refinement hot path, e.g.:
+
+    mypyc company_research_agent/text_utils.py
+
+The compiled extension is picked up in place of this file automatically;
+callers import the same names either way.
+"""
+import re
+from typing import List
+
+_YEAR_RE = re.compile(r"\b(19\d{2}|20\d{2})\b")
+
+
+def extract_years(text: str) -> List[int]:
+    """
+    Extract plausible years (1900-2099) from a text.
+    Used to detect conflicting founding years, etc.
+    """
+    return sorted({int(y) for y in _YEAR_RE.findall(text or "")})
+
+
+def update_markdown_section(
+    existing_plan: str, section_name: str, new_section_body: str
+) -> str:
+    """
+    Update or insert a specific '## section_name' in a markdown document.
+    Returns updated markdown.
+
+    - If section exists, its body is replaced.
+    - If it does not exist, it is appended at the end.
+    """
+    if not existing_plan:
+        return f"## {section_name}\n{new_section_body.strip()}\n"
+
+    # Cheap substring test first: if the name never occurs, the heading
+    # can't either, so skip the split and append directly.
+    if section_name in existing_plan:
+        # One linear split on headings; parts[0] is whatever precedes the
+        # first "\n## " and may itself start with the wanted heading.
+        new_block = f"{section_name}\n{new_section_body.strip()}\n"
+        parts = existing_plan.split("\n## ")
+        head = parts[0].partition("\n")[0]
+        if head.startswith("## ") and head[3:].strip() == section_name:
+            parts[0] = "## " + new_block
+            return "\n## ".join(parts)
+        for i in range(1, len(parts)):
+            head = parts[i].partition("\n")[0]
+            if head.strip() == section_name:
+                parts[i] = new_block
+                return "\n## ".join(parts)
+
+    # Append new section at the end
+    if not existing_plan.endswith("\n"):
+        existing_plan += "\n"
+    return existing_plan + f"\n## {section_name}\n{new_section_body.strip()}\n"